@@ -4,11 +4,19 @@ import datetime
 import json
 import logging
 import random
+import time
 from datetime import timedelta
 
 import homeassistant.util.dt
 import voluptuous as vol
-from aiohttp import ClientResponseError, ServerTimeoutError, TooManyRedirects
+from aiohttp import (
+    ClientResponseError,
+    ClientSession,
+    DummyCookieJar,
+    ServerTimeoutError,
+    TCPConnector,
+    TooManyRedirects,
+)
 from homeassistant.components.binary_sensor import (
     DEVICE_CLASS_CONNECTIVITY,
     DEVICE_CLASS_PROBLEM,
@@ -30,9 +38,10 @@ from homeassistant.const import (
     STATE_UNKNOWN,
     TEMP_CELSIUS,
 )
+from homeassistant.core import CoreState
 from homeassistant.helpers import config_validation as cv
 from homeassistant.helpers import discovery
-from homeassistant.helpers.event import async_call_later
+from homeassistant.helpers.event import async_track_time_interval
 from homeassistant.util.dt import utcnow
 from pyIndego import IndegoAsyncClient
 
@@ -86,6 +95,24 @@ SERVICE_SCHEMA_COMMAND = vol.Schema({vol.Required(CONF_SEND_COMMAND): cv.string}
 
 SERVICE_SCHEMA_SMARTMOWING = vol.Schema({vol.Required(CONF_SMARTMOWING): cv.string})
 
+ATTR_BATTERY_TEMP = f"battery_temp_{TEMP_CELSIUS}"
+ATTR_AMBIENT_TEMP = f"ambient_temp_{TEMP_CELSIUS}"
+
+# states in which the mower is active and operating data is worth fetching
+OPERATING_STATES = frozenset(range(500, 800)) | {257, 266}
+
+# endpoints refreshed together, each one is updated by _update_<endpoint>
+REFRESH_10M_ENDPOINTS = ("generic_data", "alerts", "last_completed_mow", "next_mow")
+INITIAL_ENDPOINTS = REFRESH_10M_ENDPOINTS + ("updates_available",)
+
+LONGPOLL_TIMEOUT = 300
+RETRY_MAX_DELAY = 30
+
+
+def retry_delay(attempt):
+    """Return the exponential backoff delay with jitter for a retry attempt."""
+    return min(RETRY_MAX_DELAY, 2 ** attempt) * (1 + random.random() * 0.5)
+
 
 # def FUNC_ICON_BATTERY(state):
 #     if state and not state == STATE_UNKNOWN:
@@ -159,8 +186,8 @@ ENTITY_DEFINITIONS = {
             "voltage_V",
             "discharge_Ah",
             "cycles",
-            f"battery_temp_{TEMP_CELSIUS}",
-            f"ambient_temp_{TEMP_CELSIUS}",
+            ATTR_BATTERY_TEMP,
+            ATTR_AMBIENT_TEMP,
         ],
     },
     ENTITY_LAWN_MOWED: {
@@ -225,6 +252,31 @@ ENTITY_DEFINITIONS = {
     },
 }
 
+SENSOR_DEFINITIONS = tuple(
+    (
+        entity_key,
+        entity[CONF_NAME],
+        entity[CONF_ICON],
+        entity[CONF_DEVICE_CLASS],
+        entity[CONF_UNIT_OF_MEASUREMENT],
+        tuple(entity[CONF_ATTR]),
+    )
+    for entity_key, entity in ENTITY_DEFINITIONS.items()
+    if entity[CONF_TYPE] == SENSOR_TYPE
+)
+
+BINARY_SENSOR_DEFINITIONS = tuple(
+    (
+        entity_key,
+        entity[CONF_NAME],
+        entity[CONF_ICON],
+        entity[CONF_DEVICE_CLASS],
+        tuple(entity[CONF_ATTR]),
+    )
+    for entity_key, entity in ENTITY_DEFINITIONS.items()
+    if entity[CONF_TYPE] == BINARY_SENSOR_TYPE
+)
+
 
 async def async_setup(hass, config: dict):
     """Set up the integration."""
@@ -258,15 +310,15 @@ async def async_setup(hass, config: dict):
         """Handle the service call."""
         name = call.data.get(CONF_SEND_COMMAND, DEFAULT_NAME_COMMANDS)
         _LOGGER.debug("Indego.send_command service called, with command: %s", name)
-        await hass.data[DOMAIN].indego.put_command(name)
-        await hass.data[DOMAIN]._update_state()
+        await component.indego.put_command(name)
+        await component._update_state()
 
     async def async_send_smartmowing(call):
         """Handle the service call."""
         name = call.data.get(CONF_SMARTMOWING, DEFAULT_NAME_COMMANDS)
         _LOGGER.debug("Indego.send_smartmowing service called, set to %s", name)
-        await hass.data[DOMAIN].indego.put_mow_mode(name)
-        await hass.data[DOMAIN]._update_generic_data()
+        await component.indego.put_mow_mode(name)
+        await component._update_generic_data()
 
     hass.services.async_register(
         DOMAIN, SERVICE_NAME_COMMAND, async_send_command, schema=SERVICE_SCHEMA_COMMAND
@@ -302,117 +354,147 @@ class IndegoHub:
         self._polling = polling
         self._hass = hass
 
-        self.indego = IndegoAsyncClient(self._username, self._password, self._serial)
+        # one session for the lifetime of the hub, so that consecutive polls
+        # reuse the same keep-alive connections instead of a new TLS handshake,
+        # with room for the long-poll next to a batched refresh.
+        self._session = ClientSession(
+            connector=TCPConnector(
+                limit=10,
+                limit_per_host=6,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+            ),
+            cookie_jar=DummyCookieJar(),
+            headers={"Connection": "keep-alive"},
+        )
+        self.indego = IndegoAsyncClient(
+            self._username, self._password, self._serial, session=self._session
+        )
         self.entities = {}
         self.refresh_state_task = None
         self.refresh_10m_remover = None
         self.refresh_60m_remover = None
+        self._state_failures = 0
         self._shutdown = False
         self._latest_alert = None
+        self._last_values = {}
 
     def _create_entities(self):
         """Create sub-entities and add them to Hass."""
-        for entity_key, entity in ENTITY_DEFINITIONS.items():
-            if entity[CONF_TYPE] == SENSOR_TYPE:
-                self.entities[entity_key] = IndegoSensor(
-                    f"indego_{self._serial}_{entity_key}",
-                    f"{self.mower_name} {entity[CONF_NAME]}",
-                    entity[CONF_ICON],
-                    entity[CONF_DEVICE_CLASS],
-                    entity[CONF_UNIT_OF_MEASUREMENT],
-                    entity[CONF_ATTR],
-                )
-            elif entity[CONF_TYPE] == BINARY_SENSOR_TYPE:
-                self.entities[entity_key] = IndegoBinarySensor(
-                    f"indego_{self._serial}_{entity_key}",
-                    f"{self.mower_name} {entity[CONF_NAME]}",
-                    entity[CONF_ICON],
-                    entity[CONF_DEVICE_CLASS],
-                    entity[CONF_ATTR],
-                )
+        id_prefix = f"indego_{self._serial}_"
+        name_prefix = f"{self.mower_name} "
+        for key, name, icon, device_class, attributes in BINARY_SENSOR_DEFINITIONS:
+            self.entities[key] = IndegoBinarySensor(
+                id_prefix + key,
+                name_prefix + name,
+                icon,
+                device_class,
+                attributes,
+            )
+        for key, name, icon, device_class, unit, attributes in SENSOR_DEFINITIONS:
+            self.entities[key] = IndegoSensor(
+                id_prefix + key,
+                name_prefix + name,
+                icon,
+                device_class,
+                unit,
+                attributes,
+            )
 
     async def login_and_schedule(self, load_platforms):
         """Login to the api."""
         login_success = await self.indego.login()
         if not login_success:
+            await self._session.close()
             raise AttributeError("Unable to login, please check your credentials")
         if not self._serial:
             self._serial = self.indego.serial
         self._create_entities()
         await load_platforms()
-        self._hass.bus.async_listen_once(
-            EVENT_HOMEASSISTANT_STARTED, self._initial_update
-        )
+        if self._hass.state == CoreState.running:
+            # Home Assistant has already started, the event will not fire again
+            self._hass.async_create_task(self._initial_update(None))
+        else:
+            self._hass.bus.async_listen_once(
+                EVENT_HOMEASSISTANT_STARTED, self._initial_update
+            )
         self._hass.bus.async_listen_once(EVENT_HOMEASSISTANT_STOP, self.async_shutdown)
 
     async def _initial_update(self, _):
         """Do the initial update of all entities."""
         _LOGGER.debug("Starting initial update.")
-        self.refresh_state_task = self._hass.async_create_task(self.refresh_state())
-        await asyncio.gather(*[self.refresh_10m(_), self.refresh_60m(_)])
+        self.refresh_state_task = self._hass.async_create_task(self._state_loop())
+        await self._refresh_all(INITIAL_ENDPOINTS)
+        if self._shutdown:
+            return
+        self.refresh_10m_remover = async_track_time_interval(
+            self._hass, self.refresh_10m, timedelta(minutes=10)
+        )
+        self.refresh_60m_remover = async_track_time_interval(
+            self._hass, self.refresh_60m, timedelta(minutes=60)
+        )
 
     async def async_shutdown(self, _):
         """Remove all future updates, cancel tasks and close the client."""
         self._shutdown = True
         if self.refresh_state_task:
             self.refresh_state_task.cancel()
-            await self.refresh_state_task
+            try:
+                await self.refresh_state_task
+            except asyncio.CancelledError:
+                pass
         if self.refresh_10m_remover:
             self.refresh_10m_remover()
         if self.refresh_60m_remover:
             self.refresh_60m_remover()
         await self.indego.close()
-
-    async def refresh_state(self):
-        """Update the state, if necessary update operating data and recall itself."""
-        _LOGGER.debug("Refreshing state.")
-        try:
-            await self._update_state()
-        except Exception as e:
-            _LOGGER.info("Update state got an exception: %s", e)
-        if self._shutdown:
-            return
-        if self.indego.state:
-            state = self.indego.state.state
-            if (500 <= state <= 799) or (state in (257, 266)) or self.indego._online:
-                try:
-                    _LOGGER.debug("Refreshing operating data.")
-                    await self._update_operating_data()
-                except Exception as e:
-                    _LOGGER.info("Update operating data got an exception: %s", e)
-            if self.indego.state.error != self._latest_alert:
-                self._latest_alert = self.indego.state.error
-                try:
-                    _LOGGER.debug("Refreshing alerts, to get new alert.")
-                    await self._update_alerts()
-                except Exception as e:
-                    _LOGGER.info("Update alert got an exception: %s", e)
-        self.refresh_state_task = self._hass.async_create_task(self.refresh_state())
+        await self._session.close()
+
+    async def _state_loop(self):
+        """Keep updating the state, and if necessary operating data, until shutdown."""
+        while not self._shutdown:
+            _LOGGER.debug("Refreshing state.")
+            previous_state = self.indego.state
+            started = time.monotonic()
+            try:
+                await self._update_state()
+            except Exception as e:
+                _LOGGER.info("Update state got an exception: %s", e)
+            if self._shutdown:
+                return
+            # pyIndego returns without raising when a request fails, so a
+            # long-poll that ends early without a new state counts as a failure.
+            if (
+                self.indego.state is not previous_state
+                or time.monotonic() - started >= LONGPOLL_TIMEOUT
+            ):
+                self._state_failures = 0
+            else:
+                self._state_failures += 1
+                delay = retry_delay(self._state_failures)
+                _LOGGER.debug("No new state, retrying in %.1f seconds.", delay)
+                await asyncio.sleep(delay)
+                continue
+            if self.indego.state:
+                state = self.indego.state.state
+                if state in OPERATING_STATES or self.indego._online:
+                    try:
+                        _LOGGER.debug("Refreshing operating data.")
+                        await self._update_operating_data()
+                    except Exception as e:
+                        _LOGGER.info("Update operating data got an exception: %s", e)
+                if self.indego.state.error != self._latest_alert:
+                    self._latest_alert = self.indego.state.error
+                    try:
+                        _LOGGER.debug("Refreshing alerts, to get new alert.")
+                        await self._update_alerts()
+                    except Exception as e:
+                        _LOGGER.info("Update alert got an exception: %s", e)
 
     async def refresh_10m(self, _):
         """Refresh Indego sensors every 10m."""
         _LOGGER.debug("Refreshing 10m.")
-        results = await asyncio.gather(
-            *[
-                self._update_generic_data(),
-                self._update_alerts(),
-                self._update_last_completed_mow(),
-                self._update_next_mow(),
-            ],
-            return_exceptions=True,
-        )
-        next_refresh = 600
-        index = 0
-        for res in results:
-            if res:
-                try:
-                    raise res
-                except Exception as e:
-                    _LOGGER.warning("Uncaught error: %s on index: %s", e, index)
-            index += 1
-        self.refresh_10m_remover = async_call_later(
-            self._hass, next_refresh, self.refresh_10m
-        )
+        await self._refresh_all(REFRESH_10M_ENDPOINTS)
 
     async def refresh_60m(self, _):
         """Refresh Indego sensors every 60m."""
@@ -421,12 +503,40 @@ class IndegoHub:
             await self._update_updates_available()
         except Exception as e:
             _LOGGER.info("Update updates available got an exception: %s", e)
-        self.refresh_60m_remover = async_call_later(self._hass, 3600, self.refresh_60m)
+
+    async def _refresh_all(self, endpoints):
+        """Update several endpoints at once, so the requests share the session.
+
+        Args:
+            endpoints (tuple): names of the endpoints, calls _update_<endpoint>
+
+        """
+        results = await asyncio.gather(
+            *[getattr(self, f"_update_{endpoint}")() for endpoint in endpoints],
+            return_exceptions=True,
+        )
+        for endpoint, res in zip(endpoints, results):
+            if isinstance(res, Exception):
+                _LOGGER.warning("Uncaught error: %s on endpoint: %s", res, endpoint)
+
+    def _unchanged(self, endpoint, values):
+        """Check whether an endpoint returned the same values as last time.
+
+        Args:
+            endpoint (str): name of the endpoint
+            values (tuple): the values used for the entities of the endpoint
+
+        """
+        if self._last_values.get(endpoint) == values:
+            return True
+        self._last_values[endpoint] = values
+        return False
 
     async def _update_operating_data(self):
         await self.indego.update_operating_data()
         # dependent state updates
         if self.indego.operating_data:
+            now = utcnow()
             self.entities[ENTITY_ONLINE].state = self.indego._online
             self.entities[
                 ENTITY_BATTERY
@@ -435,53 +545,68 @@ class IndegoHub:
             # dependent attribute updates
             self.entities[ENTITY_BATTERY].add_attribute(
                 {
-                    "last_updated": utcnow(),
+                    "last_updated": now,
                     "voltage_V": self.indego.operating_data.battery.voltage,
                     "discharge_Ah": self.indego.operating_data.battery.discharge,
                     "cycles": self.indego.operating_data.battery.cycles,
-                    f"battery_temp_{TEMP_CELSIUS}": self.indego.operating_data.battery.battery_temp,
-                    f"ambient_temp_{TEMP_CELSIUS}": self.indego.operating_data.battery.ambient_temp,
+                    ATTR_BATTERY_TEMP: self.indego.operating_data.battery.battery_temp,
+                    ATTR_AMBIENT_TEMP: self.indego.operating_data.battery.ambient_temp,
                 }
             )
 
     async def _update_state(self):
-        await self.indego.update_state(longpoll=True, longpoll_timeout=300)
+        await self.indego.update_state(longpoll=True, longpoll_timeout=LONGPOLL_TIMEOUT)
         # dependent state updates
         if self._shutdown:
             return
-        if self.indego.state:
+        state = self.indego.state
+        if state:
+            session = state.runtime.session
+            total = state.runtime.total
+            if self._unchanged(
+                "state",
+                (
+                    state.state,
+                    state.mowed,
+                    session.operate,
+                    session.cut,
+                    session.charge,
+                    total.operate,
+                    total.cut,
+                    total.charge,
+                ),
+            ):
+                return
+            now = utcnow()
+            detail = self.indego.state_description_detail
             self.entities[ENTITY_MOWER_STATE].state = self.indego.state_description
-            self.entities[
-                ENTITY_MOWER_STATE_DETAIL
-            ].state = self.indego.state_description_detail
-            self.entities[ENTITY_LAWN_MOWED].state = self.indego.state.mowed
-            self.entities[ENTITY_RUNTIME].state = self.indego.state.runtime.total.cut
+            self.entities[ENTITY_MOWER_STATE_DETAIL].state = detail
+            self.entities[ENTITY_LAWN_MOWED].state = state.mowed
+            self.entities[ENTITY_RUNTIME].state = total.cut
 
-            self.entities[ENTITY_BATTERY].charging = (
-                True if self.indego.state_description_detail == "Charging" else False
-            )
+            self.entities[ENTITY_BATTERY].charging = detail == "Charging"
             # dependent attribute updates
-            self.entities[ENTITY_MOWER_STATE].add_attribute({"last_updated": utcnow()})
+            self.entities[ENTITY_MOWER_STATE].add_attribute({"last_updated": now})
             self.entities[ENTITY_MOWER_STATE_DETAIL].add_attribute(
                 {
-                    "last_updated": utcnow(),
-                    "state_number": self.indego.state.state,
-                    "state_description": self.indego.state_description_detail,
+                    "last_updated": now,
+                    "state_number": state.state,
+                    "state_description": detail,
                 }
             )
             self.entities[ENTITY_LAWN_MOWED].add_attribute(
                 {
-                    "last_updated": utcnow(),
-                    "last_session_operation_min": self.indego.state.runtime.session.operate,
-                    "last_session_cut_min": self.indego.state.runtime.session.cut,
-                    "last_session_charge_min": self.indego.state.runtime.session.charge,
+                    "last_updated": now,
+                    "last_session_operation_min": session.operate,
+                    "last_session_cut_min": session.cut,
+                    "last_session_charge_min": session.charge,
                 }
             )
             self.entities[ENTITY_RUNTIME].add_attribute(
                 {
-                    "total_operation_time_h": self.indego.state.runtime.total.operate,
-                    "total_mowing_time_h": self.indego.state.runtime.total.cut,
-                    "total_charging_time_h": self.indego.state.runtime.total.charge,
+                    "total_operation_time_h": total.operate,
+                    "total_mowing_time_h": total.cut,
+                    "total_charging_time_h": total.charge,
                 }
             )
 
@@ -489,6 +614,17 @@ class IndegoHub:
         await self.indego.update_generic_data()
         # dependent state updates
         if self.indego.generic_data:
+            if self._unchanged(
+                "generic_data",
+                (
+                    self.indego.generic_data.mowing_mode_description,
+                    self.indego.generic_data.model_description,
+                    self.indego.generic_data.alm_sn,
+                    self.indego.generic_data.alm_firmware_version,
+                    self.indego.generic_data.bareToolnumber,
+                ),
+            ):
+                return
             self.entities[
                 ENTITY_MOWING_MODE
             ].state = self.indego.generic_data.mowing_mode_description
@@ -509,18 +645,29 @@ class IndegoHub:
         await self.indego.update_alerts()
         # dependent state updates
         if self.indego.alerts:
-            self.entities[ENTITY_MOWER_ALERT].state = self.indego.alerts_count
-            self.entities[ENTITY_ALERT].state = self.indego.alerts_count > 0
+            if self._unchanged(
+                "alerts",
+                tuple(
+                    (alert.alert_id, alert.read_status, alert.flag)
+                    for alert in self.indego.alerts
+                ),
+            ):
+                return
+            alerts_count = self.indego.alerts_count
+            self.entities[ENTITY_MOWER_ALERT].state = alerts_count
+            self.entities[ENTITY_ALERT].state = alerts_count > 0
 
             self.entities[ENTITY_ALERT].add_attribute(
                 {
-                    "alerts_count": self.indego.alerts_count,
+                    "alerts_count": alerts_count,
                     "alert_details": str(self.indego.alerts),
                 }
             )
 
     async def _update_updates_available(self):
         await self.indego.update_updates_available()
+        if self._unchanged("updates_available", (self.indego.update_available,)):
+            return
         # dependent state updates
         self.entities[ENTITY_UPDATE_AVAILABLE].state = self.indego.update_available
 